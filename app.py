@@ -3,8 +3,16 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from pymongo import MongoClient
 from bson import ObjectId  # Correct import for ObjectId
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
 import json
+import gzip
+import os
+import re
+import unicodedata
+import shutil
+import tempfile
+import threading
 
 app = Flask(__name__)
 CORS(app)
@@ -25,6 +33,8 @@ beneficiaries_collection = db.beneficiaries
 services_collection = db.services
 billing_collection = db.billing
 policies_collection = db.policies
+analytics_deletions_collection = db.analytics_deletions
+plan_distribution_collection = db.plan_distribution
 
 # Helper function to convert ObjectId to string
 def serialize_doc(doc):
@@ -41,6 +51,254 @@ def serialize_doc(doc):
         return doc
     return doc
 
+# Billing report cache
+# Reports are cached per normalized date range. Concurrent identical requests
+# share one computation (single-flight), and writes to billing evict only the
+# cached ranges that contain the affected serviceDate.
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 32))
+
+report_cache = OrderedDict()
+report_cache_inflight = {}
+report_cache_lock = threading.Lock()
+report_cache_generation = 0
+report_cache_stats = {"hits": 0, "misses": 0, "shared": 0, "evictions": 0, "invalidations": 0}
+
+def to_utc_naive(value):
+    # MongoDB returns naive UTC datetimes; parsed request dates may be aware
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def get_cached_billing_report(key, compute):
+    while True:
+        with report_cache_lock:
+            if key in report_cache:
+                report_cache.move_to_end(key)
+                report_cache_stats["hits"] += 1
+                return report_cache[key]
+            flight = report_cache_inflight.get(key)
+            if flight is None:
+                flight = {"event": threading.Event(), "report": None}
+                report_cache_inflight[key] = flight
+                report_cache_stats["misses"] += 1
+                generation = report_cache_generation
+                break
+        
+        # Another request is already computing this report; share its result
+        flight["event"].wait()
+        if flight["report"] is not None:
+            with report_cache_lock:
+                report_cache_stats["shared"] += 1
+            return flight["report"]
+    
+    try:
+        report = compute()
+        flight["report"] = report
+    finally:
+        with report_cache_lock:
+            report_cache_inflight.pop(key, None)
+            # Skip storing a result that a concurrent write may have made stale
+            if flight["report"] is not None and generation == report_cache_generation:
+                report_cache[key] = flight["report"]
+                while len(report_cache) > REPORT_CACHE_SIZE:
+                    report_cache.popitem(last=False)
+                    report_cache_stats["evictions"] += 1
+        flight["event"].set()
+    return report
+
+def invalidate_billing_reports(*service_dates):
+    global report_cache_generation
+    dates = [to_utc_naive(value) for value in service_dates]
+    with report_cache_lock:
+        report_cache_generation += 1
+        for key in list(report_cache):
+            start, end = key
+            # Unbounded reports and unknown dates always invalidate
+            if start is None or any(not isinstance(value, datetime) or start <= value <= end for value in dates):
+                del report_cache[key]
+                report_cache_stats["invalidations"] += 1
+
+def clear_billing_reports():
+    invalidate_billing_reports(None)
+
+# Member resolution
+# services and billing only carry a free-text patientName, so it is resolved
+# to an employee or beneficiary reference (memberType/memberId) at write time
+# through an indexed, normalized-name lookup.
+MEMBER_KEY_FIELDS = ('firstName', 'lastName', 'nameKey')
+
+def normalize_name(name):
+    if not isinstance(name, str):
+        return None
+    # Keep Unicode letters so accented and non-Latin names still resolve
+    key = " ".join(unicodedata.normalize('NFKC', name).casefold().split())
+    key = re.sub(r"[^\w ]", "", key)
+    return " ".join(key.split()) or None
+
+def build_name_key(doc):
+    return normalize_name(f"{doc.get('firstName', '')} {doc.get('lastName', '')}")
+
+def refresh_name_key(collection, object_id):
+    doc = collection.find_one({"_id": object_id}, {"firstName": 1, "lastName": 1})
+    if doc:
+        name_key = build_name_key(doc)
+        collection.update_one({"_id": object_id}, {"$set": {"nameKey": name_key}})
+        return name_key
+
+def member_lookup_keys(doc, id_field):
+    # patientName values that could resolve to this member, as patientKeys.
+    # Members created before nameKey existed fall back to their names.
+    name_key = doc.get('nameKey') or build_name_key(doc)
+    return {key for key in (name_key, normalize_name(doc.get(id_field))) if key}
+
+def resolve_member(patient_name):
+    if not isinstance(patient_name, str):
+        return None
+    
+    # An exact member ID (e.g. "EMP001") wins over name matching
+    value = patient_name.strip()
+    employee = employees_collection.find_one({"employeeId": value}, {"_id": 1})
+    if employee:
+        return {"memberType": "employee", "memberId": str(employee["_id"])}
+    beneficiary = beneficiaries_collection.find_one({"beneficiaryId": value}, {"_id": 1})
+    if beneficiary:
+        return {"memberType": "beneficiary", "memberId": str(beneficiary["_id"])}
+    
+    key = normalize_name(patient_name)
+    if not key:
+        return None
+    matches = [("employee", doc) for doc in employees_collection.find({"nameKey": key}, {"_id": 1}).limit(2)]
+    matches += [("beneficiary", doc) for doc in beneficiaries_collection.find({"nameKey": key}, {"_id": 1}).limit(2)]
+    
+    # Leave ambiguous names unresolved rather than guessing
+    if len(matches) != 1:
+        return None
+    member_type, doc = matches[0]
+    return {"memberType": member_type, "memberId": str(doc["_id"])}
+
+def apply_member_reference(data):
+    if 'patientName' in data:
+        data['patientKey'] = normalize_name(data['patientName'])
+        data.update(resolve_member(data['patientName']) or {"memberType": None, "memberId": None})
+
+def update_member_references(query):
+    # Resolve each distinct patient name once and update its rows in bulk.
+    # Only rows whose reference changes are touched (and get a new updatedAt).
+    resolved = {}
+    counts = {}
+    for name, collection in (("services", services_collection), ("billing", billing_collection)):
+        counts[name] = {"resolved": 0, "unresolved": 0}
+        for patient_name in collection.distinct("patientName", query):
+            if patient_name not in resolved:
+                resolved[patient_name] = resolve_member(patient_name)
+            reference = resolved[patient_name] or {"memberType": None, "memberId": None}
+            result = collection.update_many(
+                {"$and": [query, {"patientName": patient_name, "memberId": {"$ne": reference["memberId"]}}]},
+                {"$set": dict(reference, updatedAt=datetime.utcnow())}
+            )
+            counts[name]["resolved" if resolved[patient_name] else "unresolved"] += result.modified_count
+    
+    if counts["billing"]["resolved"] or counts["billing"]["unresolved"]:
+        clear_billing_reports()
+    return counts
+
+def reresolve_member_references(keys, member_id=None):
+    # Re-resolve rows that could match a created, renamed or deleted member
+    conditions = [{"patientKey": {"$in": sorted(keys)}}]
+    if member_id:
+        conditions.append({"memberId": member_id})
+    return update_member_references({"$or": conditions})
+
+def backfill_member_references():
+    for collection in (employees_collection, beneficiaries_collection):
+        for doc in collection.find({}, {"firstName": 1, "lastName": 1}):
+            collection.update_one({"_id": doc["_id"]}, {"$set": {"nameKey": build_name_key(doc)}})
+    
+    for collection in (services_collection, billing_collection):
+        for patient_name in collection.distinct("patientName"):
+            patient_key = normalize_name(patient_name)
+            collection.update_many(
+                {"patientName": patient_name, "patientKey": {"$ne": patient_key}},
+                {"$set": {"patientKey": patient_key}}
+            )
+    
+    return update_member_references({})
+
+# Coverage plan distribution
+# Employee counts per (coveragePlan, department, status) live in the
+# plan_distribution collection and are adjusted on every employee write, so
+# the dashboard reads a handful of counters instead of scanning employees.
+DISTRIBUTION_FIELDS = ('coveragePlan', 'department', 'status')
+
+# Held around each employee write and its counter adjustment, and for the
+# whole of a rebuild, so no adjustment lands between the rebuild's read and
+# its swap. It only serializes writers within one server process.
+plan_distribution_lock = threading.Lock()
+
+def distribution_key(doc):
+    return {field: doc.get(field) for field in DISTRIBUTION_FIELDS}
+
+def adjust_plan_distribution(doc, amount):
+    plan_distribution_collection.update_one(
+        distribution_key(doc),
+        {"$inc": {"count": amount}},
+        upsert=True
+    )
+
+def move_plan_distribution(before, after):
+    if distribution_key(before) != distribution_key(after):
+        adjust_plan_distribution(before, -1)
+        adjust_plan_distribution(after, 1)
+
+def rebuild_plan_distribution():
+    # Build the counters in a staging collection and swap it in with a single
+    # rename, so readers never see a half-built collection
+    staging_name = f"plan_distribution_rebuild_{ObjectId()}"
+    pipeline = [
+        {
+            "$group": {
+                "_id": {field: f"${field}" for field in DISTRIBUTION_FIELDS},
+                "count": {"$sum": 1}
+            }
+        },
+        {"$project": dict({field: f"$_id.{field}" for field in DISTRIBUTION_FIELDS}, _id=0, count=1)},
+        {"$out": staging_name}
+    ]
+    with plan_distribution_lock:
+        list(employees_collection.aggregate(pipeline))
+        db[staging_name].create_index([(field, 1) for field in DISTRIBUTION_FIELDS], unique=True)
+        db[staging_name].rename(plan_distribution_collection.name, dropTarget=True)
+
+def policy_plan_name(policy):
+    # planName is the coveragePlan value employees on this policy carry
+    return policy.get('planName') or policy.get('policyName')
+
+def clean_plan_name(value):
+    # Returns the stripped plan name, or None when it is not a usable name
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()
+
+def ensure_indexes():
+    employees_collection.create_index("employeeId")
+    employees_collection.create_index("nameKey")
+    beneficiaries_collection.create_index("beneficiaryId")
+    beneficiaries_collection.create_index("nameKey")
+    services_collection.create_index("memberId")
+    services_collection.create_index("patientKey")
+    billing_collection.create_index("memberId")
+    billing_collection.create_index("patientKey")
+    plan_distribution_collection.create_index([(field, 1) for field in DISTRIBUTION_FIELDS], unique=True)
+    analytics_deletions_collection.create_index("collection")
+
+try:
+    ensure_indexes()
+    # Seed the distribution counters for databases created before they existed
+    if plan_distribution_collection.estimated_document_count() == 0 and employees_collection.estimated_document_count() > 0:
+        rebuild_plan_distribution()
+except Exception as e:
+    print(f"Error creating indexes: {e}")
+
 # Dashboard endpoint
 @app.route('/api/dashboard', methods=['GET'])
 def get_dashboard():
@@ -103,31 +361,47 @@ def get_service_usage_data():
     except:
         return [65, 78, 85, 92, 88, 95, 102, 88, 96, 78, 85, 92]
 
-def get_coverage_distribution_data():
+def get_coverage_distribution_data(department=None, status=None):
+    query = {"count": {"$gt": 0}}
+    if department:
+        query['department'] = department
+    if status:
+        query['status'] = status
+    breakdown = list(plan_distribution_collection.find(query, {"_id": 0}))
+    
+    totals = {}
+    for row in breakdown:
+        row['coveragePlan'] = row.get('coveragePlan') or "Unassigned"
+        totals[row['coveragePlan']] = totals.get(row['coveragePlan'], 0) + row["count"]
+    
+    # Every policy gets a slot, followed by any plan no policy defines yet
+    labels = []
+    for policy in policies_collection.find({}, {"policyName": 1, "planName": 1}).sort("createdAt", 1):
+        plan = policy_plan_name(policy)
+        if plan and plan not in labels:
+            labels.append(plan)
+    labels += [plan for plan in totals if plan not in labels]
+    
+    return {
+        "labels": labels,
+        "data": [totals.get(plan, 0) for plan in labels],
+        "breakdown": breakdown
+    }
+
+@app.route('/api/coverage-distribution', methods=['GET'])
+def get_coverage_distribution():
     try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$coveragePlan",
-                    "count": {"$sum": 1}
-                }
-            }
-        ]
-        results = list(employees_collection.aggregate(pipeline))
-        
-        # Convert to array format for chart
-        coverage_data = [0, 0, 0]  # [Basic, Premium, Family]
-        for result in results:
-            if result["_id"] == "Basic":
-                coverage_data[0] = result["count"]
-            elif result["_id"] == "Premium":
-                coverage_data[1] = result["count"]
-            elif result["_id"] == "Family":
-                coverage_data[2] = result["count"]
-        
-        return coverage_data
-    except:
-        return [65, 25, 10]
+        return jsonify(get_coverage_distribution_data(request.args.get('department'), request.args.get('status')))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/coverage-distribution/rebuild', methods=['POST'])
+def rebuild_coverage_distribution():
+    try:
+        rebuild_plan_distribution()
+        return jsonify({"message": "Coverage distribution rebuilt successfully"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 # Employee endpoints
 @app.route('/api/employees', methods=['GET'])
@@ -154,10 +428,14 @@ def create_employee():
             return jsonify({"error": "Employee ID already exists"}), 400
         
         # Add timestamps
+        data['nameKey'] = build_name_key(data)
         data['createdAt'] = datetime.utcnow()
         data['updatedAt'] = datetime.utcnow()
         
-        result = employees_collection.insert_one(data)
+        with plan_distribution_lock:
+            result = employees_collection.insert_one(data)
+            adjust_plan_distribution(data, 1)
+        reresolve_member_references(member_lookup_keys(data, 'employeeId'))
         return jsonify({"message": "Employee created successfully", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -178,14 +456,27 @@ def update_employee(employee_id):
         data = request.get_json()
         data['updatedAt'] = datetime.utcnow()
         
-        result = employees_collection.update_one(
-            {"_id": ObjectId(employee_id)},
-            {"$set": data}
-        )
+        with plan_distribution_lock:
+            previous = employees_collection.find_one_and_update(
+                {"_id": ObjectId(employee_id)},
+                {"$set": data},
+                projection={field: 1 for field in DISTRIBUTION_FIELDS + MEMBER_KEY_FIELDS + ('employeeId',)}
+            )
+            if previous is not None:
+                move_plan_distribution(previous, dict(previous, **data))
         
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({"error": "Employee not found"}), 404
         
+        current = dict(previous, **data)
+        
+        if 'firstName' in data or 'lastName' in data or 'employeeId' in data:
+            current['nameKey'] = refresh_name_key(employees_collection, ObjectId(employee_id))
+            reresolve_member_references(
+                member_lookup_keys(previous, 'employeeId') | member_lookup_keys(current, 'employeeId'),
+                employee_id
+            )
+        
         return jsonify({"message": "Employee updated successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -193,11 +484,19 @@ def update_employee(employee_id):
 @app.route('/api/employees/<employee_id>', methods=['DELETE'])
 def delete_employee(employee_id):
     try:
-        result = employees_collection.delete_one({"_id": ObjectId(employee_id)})
-        
-        if result.deleted_count == 0:
+        with plan_distribution_lock:
+            deleted = employees_collection.find_one_and_delete(
+                {"_id": ObjectId(employee_id)},
+                projection={field: 1 for field in DISTRIBUTION_FIELDS + MEMBER_KEY_FIELDS + ('employeeId',)}
+            )
+            if deleted is not None:
+                adjust_plan_distribution(deleted, -1)
+        
+        if deleted is None:
             return jsonify({"error": "Employee not found"}), 404
         
+        reresolve_member_references(member_lookup_keys(deleted, 'employeeId'), employee_id)
+        
         return jsonify({"message": "Employee deleted successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -273,10 +572,12 @@ def create_beneficiary():
             return jsonify({"error": "Employee not found"}), 400
         
         # Add timestamps
+        data['nameKey'] = build_name_key(data)
         data['createdAt'] = datetime.utcnow()
         data['updatedAt'] = datetime.utcnow()
         
         result = beneficiaries_collection.insert_one(data)
+        reresolve_member_references(member_lookup_keys(data, 'beneficiaryId'))
         return jsonify({"message": "Beneficiary created successfully", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -297,14 +598,23 @@ def update_beneficiary(beneficiary_id):
         data = request.get_json()
         data['updatedAt'] = datetime.utcnow()
         
-        result = beneficiaries_collection.update_one(
+        previous = beneficiaries_collection.find_one_and_update(
             {"_id": ObjectId(beneficiary_id)},
-            {"$set": data}
+            {"$set": data},
+            projection={field: 1 for field in MEMBER_KEY_FIELDS + ('beneficiaryId',)}
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({"error": "Beneficiary not found"}), 404
         
+        if 'firstName' in data or 'lastName' in data or 'beneficiaryId' in data:
+            current = dict(previous, **data)
+            current['nameKey'] = refresh_name_key(beneficiaries_collection, ObjectId(beneficiary_id))
+            reresolve_member_references(
+                member_lookup_keys(previous, 'beneficiaryId') | member_lookup_keys(current, 'beneficiaryId'),
+                beneficiary_id
+            )
+        
         return jsonify({"message": "Beneficiary updated successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -312,11 +622,16 @@ def update_beneficiary(beneficiary_id):
 @app.route('/api/beneficiaries/<beneficiary_id>', methods=['DELETE'])
 def delete_beneficiary(beneficiary_id):
     try:
-        result = beneficiaries_collection.delete_one({"_id": ObjectId(beneficiary_id)})
+        deleted = beneficiaries_collection.find_one_and_delete(
+            {"_id": ObjectId(beneficiary_id)},
+            projection={field: 1 for field in MEMBER_KEY_FIELDS + ('beneficiaryId',)}
+        )
         
-        if result.deleted_count == 0:
+        if deleted is None:
             return jsonify({"error": "Beneficiary not found"}), 404
         
+        reresolve_member_references(member_lookup_keys(deleted, 'beneficiaryId'), beneficiary_id)
+        
         return jsonify({"message": "Beneficiary deleted successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -345,6 +660,8 @@ def create_service():
         if isinstance(data['date'], str):
             data['date'] = datetime.fromisoformat(data['date'].replace('Z', '+00:00'))
         
+        apply_member_reference(data)
+        
         # Add timestamps
         data['createdAt'] = datetime.utcnow()
         data['updatedAt'] = datetime.utcnow()
@@ -374,6 +691,8 @@ def update_service(service_id):
         if 'date' in data and isinstance(data['date'], str):
             data['date'] = datetime.fromisoformat(data['date'].replace('Z', '+00:00'))
         
+        apply_member_reference(data)
+        
         result = services_collection.update_one(
             {"_id": ObjectId(service_id)},
             {"$set": data}
@@ -394,6 +713,8 @@ def delete_service(service_id):
         if result.deleted_count == 0:
             return jsonify({"error": "Service not found"}), 404
         
+        record_analytics_deletion('services', str(ObjectId(service_id)))
+        
         return jsonify({"message": "Service deleted successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -422,11 +743,14 @@ def create_billing():
         if isinstance(data['serviceDate'], str):
             data['serviceDate'] = datetime.fromisoformat(data['serviceDate'].replace('Z', '+00:00'))
         
+        apply_member_reference(data)
+        
         # Add timestamps
         data['createdAt'] = datetime.utcnow()
         data['updatedAt'] = datetime.utcnow()
         
         result = billing_collection.insert_one(data)
+        invalidate_billing_reports(data['serviceDate'])
         return jsonify({"message": "Billing record created successfully", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -451,14 +775,19 @@ def update_billing(billing_id):
         if 'serviceDate' in data and isinstance(data['serviceDate'], str):
             data['serviceDate'] = datetime.fromisoformat(data['serviceDate'].replace('Z', '+00:00'))
         
-        result = billing_collection.update_one(
+        apply_member_reference(data)
+        
+        previous = billing_collection.find_one_and_update(
             {"_id": ObjectId(billing_id)},
-            {"$set": data}
+            {"$set": data},
+            projection={"serviceDate": 1}
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({"error": "Billing record not found"}), 404
         
+        invalidate_billing_reports(previous.get('serviceDate'), data.get('serviceDate', previous.get('serviceDate')))
+        
         return jsonify({"message": "Billing record updated successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -466,11 +795,17 @@ def update_billing(billing_id):
 @app.route('/api/billing/<billing_id>', methods=['DELETE'])
 def delete_billing(billing_id):
     try:
-        result = billing_collection.delete_one({"_id": ObjectId(billing_id)})
+        deleted = billing_collection.find_one_and_delete(
+            {"_id": ObjectId(billing_id)},
+            projection={"serviceDate": 1}
+        )
         
-        if result.deleted_count == 0:
+        if deleted is None:
             return jsonify({"error": "Billing record not found"}), 404
         
+        invalidate_billing_reports(deleted.get('serviceDate'))
+        record_analytics_deletion('billing', str(deleted['_id']))
+        
         return jsonify({"message": "Billing record deleted successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -495,6 +830,12 @@ def create_policy():
             if field not in data:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
         
+        # planName links the policy to employees' coveragePlan; it defaults
+        # to the policy name when not given
+        data['planName'] = clean_plan_name(data.get('planName') or data['policyName'])
+        if data['planName'] is None:
+            return jsonify({"error": "planName must be a non-empty string"}), 400
+        
         # Add timestamps
         data['createdAt'] = datetime.utcnow()
         data['updatedAt'] = datetime.utcnow()
@@ -510,6 +851,11 @@ def update_policy(policy_id):
         data = request.get_json()
         data['updatedAt'] = datetime.utcnow()
         
+        if 'planName' in data:
+            data['planName'] = clean_plan_name(data['planName'])
+            if data['planName'] is None:
+                return jsonify({"error": "planName must be a non-empty string"}), 400
+        
         result = policies_collection.update_one(
             {"_id": ObjectId(policy_id)},
             {"$set": data}
@@ -530,37 +876,344 @@ def generate_billing_report():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
+        # Normalize the range so equivalent requests share a cache entry
+        key = (None, None)
         query = {}
         if start_date and end_date:
+            key = (to_utc_naive(datetime.fromisoformat(start_date)), to_utc_naive(datetime.fromisoformat(end_date)))
             query['serviceDate'] = {
-                '$gte': datetime.fromisoformat(start_date),
-                '$lte': datetime.fromisoformat(end_date)
+                '$gte': key[0],
+                '$lte': key[1]
             }
         
-        # Aggregate billing data
-        pipeline = [
-            {"$match": query},
+        def compute():
+            # Aggregate billing data
+            pipeline = [
+                {"$match": query},
+                {
+                    "$group": {
+                        "_id": "$status",
+                        "count": {"$sum": 1},
+                        "totalAmount": {"$sum": "$amount"}
+                    }
+                }
+            ]
+            
+            results = list(billing_collection.aggregate(pipeline))
+            
+            # Get detailed records
+            detailed_records = list(billing_collection.find(query))
+            
+            return {
+                "summary": results,
+                "detailedRecords": serialize_doc(detailed_records),
+                "generatedAt": datetime.utcnow().isoformat()
+            }
+        
+        report = get_cached_billing_report(key, compute)
+        return jsonify(report)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/billing/cache', methods=['GET'])
+def get_billing_report_cache_stats():
+    with report_cache_lock:
+        stats = dict(report_cache_stats)
+        stats["size"] = len(report_cache)
+    stats["maxSize"] = REPORT_CACHE_SIZE
+    requests_served = stats["hits"] + stats["misses"] + stats["shared"]
+    stats["hitRate"] = (stats["hits"] + stats["shared"]) / requests_served if requests_served else 0
+    return jsonify(stats)
+
+# Member endpoints
+@app.route('/api/members/backfill', methods=['POST'])
+def backfill_members():
+    try:
+        counts = backfill_member_references()
+        return jsonify({"message": "Member references backfilled successfully", "results": counts})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/members/<member_id>/utilization', methods=['GET'])
+def get_member_utilization(member_id):
+    try:
+        services_pipeline = [
+            {"$match": {"memberId": member_id}},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "totalCost": {"$sum": "$cost"}}}
+        ]
+        billing_pipeline = [
+            {"$match": {"memberId": member_id}},
             {
                 "$group": {
-                    "_id": "$status",
+                    "_id": None,
                     "count": {"$sum": 1},
-                    "totalAmount": {"$sum": "$amount"}
+                    "totalAmount": {"$sum": "$amount"},
+                    "coveredAmount": {"$sum": {"$divide": [{"$multiply": ["$amount", "$coverage"]}, 100]}}
                 }
             }
         ]
+        services_result = list(services_collection.aggregate(services_pipeline))
+        billing_result = list(billing_collection.aggregate(billing_pipeline))
         
-        results = list(billing_collection.aggregate(pipeline))
-        
-        # Get detailed records
-        detailed_records = list(billing_collection.find(query))
-        
-        report = {
-            "summary": results,
-            "detailedRecords": serialize_doc(detailed_records),
-            "generatedAt": datetime.utcnow().isoformat()
-        }
+        services_summary = services_result[0] if services_result else {"count": 0, "totalCost": 0}
+        billing_summary = billing_result[0] if billing_result else {"count": 0, "totalAmount": 0, "coveredAmount": 0}
         
-        return jsonify(report)
+        return jsonify({
+            "memberId": member_id,
+            "services": {
+                "count": services_summary["count"],
+                "totalCost": services_summary["totalCost"]
+            },
+            "billing": {
+                "count": billing_summary["count"],
+                "totalAmount": billing_summary["totalAmount"],
+                "coveredAmount": billing_summary["coveredAmount"],
+                "patientResponsibility": billing_summary["totalAmount"] - billing_summary["coveredAmount"]
+            }
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Analytics snapshots
+# Billing and services are exported incrementally (using updatedAt as the
+# watermark) into gzip-compressed files on local disk, one file per column,
+# so ad-hoc analytical queries never touch the operational database and only
+# read the columns they use. Each export appends a new segment holding the
+# changed rows; deletes are logged as tombstones by the delete endpoints.
+ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analytics'))
+
+# updatedAt is stamped by the request handler before the write reaches the
+# database, so a write can land after an export with an older timestamp.
+# The watermark trails the export start by this many seconds to pick those up.
+ANALYTICS_WATERMARK_LAG = int(os.environ.get('ANALYTICS_WATERMARK_LAG', 300))
+
+# Segments are merged into one once an export leaves more than this many
+ANALYTICS_MAX_SEGMENTS = int(os.environ.get('ANALYTICS_MAX_SEGMENTS', 16))
+
+ANALYTICS_SOURCES = {
+    'billing': {
+        'collection': billing_collection,
+        'dateField': 'serviceDate',
+        'columns': ['claimId', 'serviceDate', 'patientName', 'memberType', 'memberId', 'service', 'amount', 'coverage', 'status', 'updatedAt']
+    },
+    'services': {
+        'collection': services_collection,
+        'dateField': 'date',
+        'columns': ['serviceId', 'date', 'patientName', 'memberType', 'memberId', 'serviceType', 'provider', 'cost', 'status', 'updatedAt']
+    }
+}
+
+analytics_export_lock = threading.Lock()
+
+def record_analytics_deletion(name, doc_id=None):
+    # A docId of None means every row of the collection was deleted
+    analytics_deletions_collection.insert_one({"collection": name, "docId": doc_id, "deletedAt": datetime.utcnow()})
+
+def get_analytics_path(name, *parts):
+    return os.path.join(ANALYTICS_DIR, name, *parts)
+
+def read_json_gz(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json_gz(path, value):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a unique temp file and swap it in so readers never see a partial file
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as tmp:
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump(value, f)
+    os.replace(tmp.name, path)
+
+def load_manifest(name):
+    # Returns None when the snapshot is missing or was written with a
+    # different column set than the code now exports
+    path = get_analytics_path(name, 'manifest.json.gz')
+    if not os.path.exists(path):
+        return None
+    manifest = read_json_gz(path)
+    if manifest['columns'] != ['_id'] + ANALYTICS_SOURCES[name]['columns']:
+        return None
+    return manifest
+
+def read_snapshot_columns(name, manifest, columns):
+    # Later segments hold newer versions of a row; tombstoned ids are dropped.
+    # The _id column is always returned alongside the requested ones.
+    segments = [segment['id'] for segment in manifest['segments']]
+    ids = [read_json_gz(get_analytics_path(name, segment, '_id.json.gz')) for segment in segments]
+    deleted = set()
+    latest = {}
+    for s, segment in enumerate(segments):
+        deleted.update(read_json_gz(get_analytics_path(name, segment, '_deleted.json.gz')))
+        for i, doc_id in enumerate(ids[s]):
+            latest[doc_id] = (s, i)
+    rows = [position for doc_id, position in latest.items() if doc_id not in deleted]
+    
+    result = {'_id': [ids[s][i] for s, i in rows]}
+    for column in columns:
+        if column not in result:
+            values = [read_json_gz(get_analytics_path(name, segment, f"{column}.json.gz")) for segment in segments]
+            result[column] = [values[s][i] for s, i in rows]
+    return result
+
+def write_segment(name, columns, rows, deleted_ids):
+    segment = str(ObjectId())
+    for column in columns:
+        write_json_gz(get_analytics_path(name, segment, f"{column}.json.gz"), rows[column])
+    write_json_gz(get_analytics_path(name, segment, '_deleted.json.gz'), deleted_ids)
+    return {"id": segment, "rows": len(rows['_id'])}
+
+def remove_unreferenced_segments(name, manifest):
+    referenced = {segment['id'] for segment in manifest['segments']}
+    for entry in os.listdir(get_analytics_path(name)):
+        path = get_analytics_path(name, entry)
+        if os.path.isdir(path) and entry not in referenced:
+            shutil.rmtree(path, ignore_errors=True)
+
+def export_snapshot(name):
+    source = ANALYTICS_SOURCES[name]
+    collection = source['collection']
+    columns = ['_id'] + source['columns']
+    manifest = load_manifest(name)
+    
+    # Only fetch documents changed since the last export. Rows inside the
+    # watermark lag are exported again; readers keep the newest copy.
+    started_at = datetime.utcnow()
+    tombstones = list(analytics_deletions_collection.find({"collection": name}))
+    deleted_ids = [tombstone['docId'] for tombstone in tombstones]
+    
+    # Missing, stale or truncated snapshots are rebuilt from scratch
+    if manifest is None or None in deleted_ids:
+        manifest = {"columns": columns, "watermark": None, "segments": []}
+        deleted_ids = []
+    
+    query = {}
+    if manifest['watermark']:
+        query['updatedAt'] = {'$gte': datetime.fromisoformat(manifest['watermark'])}
+    projection = {column: 1 for column in source['columns']}
+    changed = serialize_doc(list(collection.find(query, projection)))
+    
+    if changed or deleted_ids:
+        rows = {column: [doc.get(column) for doc in changed] for column in columns}
+        manifest['segments'].append(write_segment(name, columns, rows, deleted_ids))
+    
+    if len(manifest['segments']) > ANALYTICS_MAX_SEGMENTS:
+        rows = read_snapshot_columns(name, manifest, columns)
+        manifest['segments'] = [write_segment(name, columns, rows, [])]
+    
+    manifest['watermark'] = (started_at - timedelta(seconds=ANALYTICS_WATERMARK_LAG)).isoformat()
+    manifest['exportedAt'] = datetime.utcnow().isoformat()
+    write_json_gz(get_analytics_path(name, 'manifest.json.gz'), manifest)
+    remove_unreferenced_segments(name, manifest)
+    
+    # Exports are serialized, so the tombstones read above are now consumed
+    analytics_deletions_collection.delete_many({"_id": {"$in": [tombstone['_id'] for tombstone in tombstones]}})
+    
+    return {
+        "collection": name,
+        "changed": len(changed),
+        "removed": len(deleted_ids),
+        "segments": len(manifest['segments']),
+        "watermark": manifest['watermark']
+    }
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def to_number(value):
+    return value if is_number(value) else 0
+
+def matches_filter(value, expected):
+    # Query parameters are strings; numeric cells are compared as numbers
+    if is_number(value):
+        try:
+            return value == float(expected)
+        except ValueError:
+            return False
+    return str(value) == expected
+
+@app.route('/api/analytics/export', methods=['POST'])
+def export_analytics():
+    try:
+        # One export at a time; concurrent exports would race on the manifest
+        with analytics_export_lock:
+            results = [export_snapshot(name) for name in ANALYTICS_SOURCES]
+        return jsonify({"message": "Analytics snapshots exported successfully", "results": results})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analytics/query', methods=['GET'])
+def query_analytics():
+    try:
+        name = request.args.get('collection', 'billing')
+        if name not in ANALYTICS_SOURCES:
+            return jsonify({"error": f"Unknown collection: {name}"}), 400
+        
+        source = ANALYTICS_SOURCES[name]
+        manifest = load_manifest(name)
+        if manifest is None:
+            return jsonify({"error": f"Analytics snapshot for {name} is missing or stale, run POST /api/analytics/export"}), 409
+        available = set(manifest['columns']) | {'month'}
+        
+        group_by = [key for key in request.args.get('group_by', '').split(',') if key]
+        for key in group_by:
+            if key not in available:
+                return jsonify({"error": f"Unknown group_by column: {key}"}), 400
+        
+        metric = request.args.get('metric')
+        if metric and metric not in manifest['columns']:
+            return jsonify({"error": f"Unknown metric column: {metric}"}), 400
+        
+        # Column filters, e.g. ?status=Pending&provider=City Hospital
+        reserved = {'collection', 'group_by', 'metric'}
+        filters = {key: value for key, value in request.args.items() if key not in reserved}
+        for key in filters:
+            if key not in available:
+                return jsonify({"error": f"Unknown filter column: {key}"}), 400
+        
+        # Read only the columns this query touches
+        needed = set(group_by) | set(filters) | ({metric} if metric else set())
+        if 'month' in needed:
+            needed = (needed - {'month'}) | {source['dateField']}
+        try:
+            columns = read_snapshot_columns(name, manifest, sorted(needed))
+        except FileNotFoundError:
+            # A concurrent export compacted the segments we were reading
+            manifest = load_manifest(name)
+            columns = read_snapshot_columns(name, manifest, sorted(needed))
+
+        # "month" is derived from the collection's date column (YYYY-MM)
+        if source['dateField'] in columns:
+            columns['month'] = [value[:7] if isinstance(value, str) else None for value in columns[source['dateField']]]
+        
+        if metric and not all(value is None or is_number(value) for value in columns[metric]):
+            return jsonify({"error": f"Metric column is not numeric: {metric}"}), 400
+        
+        selected = range(len(columns['_id']))
+        for key, value in filters.items():
+            values = columns[key]
+            selected = [i for i in selected if matches_filter(values[i], value)]
+        
+        key_columns = [columns[key] for key in group_by]
+        metric_values = columns[metric] if metric else None
+        groups = {}
+        for i in selected:
+            group_key = tuple(values[i] for values in key_columns)
+            group = groups.setdefault(group_key, {"count": 0, "total": 0})
+            group["count"] += 1
+            if metric_values is not None:
+                group["total"] += to_number(metric_values[i])
+        
+        results = []
+        for group_key, group in sorted(groups.items(), key=lambda item: [str(v) for v in item[0]]):
+            row = dict(zip(group_by, group_key))
+            row["count"] = group["count"]
+            if metric:
+                row["total"] = group["total"]
+                row["average"] = group["total"] / group["count"]
+            results.append(row)
+        
+        return jsonify({"collection": name, "groupBy": group_by, "metric": metric, "results": results})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -584,6 +1237,8 @@ def initialize_sample_data():
         services_collection.delete_many({})
         billing_collection.delete_many({})
         policies_collection.delete_many({})
+        record_analytics_deletion('services')
+        record_analytics_deletion('billing')
         
         # Insert sample employees
         sample_employees = [
@@ -712,6 +1367,7 @@ def initialize_sample_data():
         sample_policies = [
             {
                 "policyName": "Basic Coverage",
+                "planName": "Basic",
                 "annualLimit": 5000,
                 "deductible": 500,
                 "coverage": 80,
@@ -721,6 +1377,7 @@ def initialize_sample_data():
             },
             {
                 "policyName": "Premium Coverage",
+                "planName": "Premium",
                 "annualLimit": 15000,
                 "deductible": 250,
                 "coverage": 90,
@@ -730,6 +1387,7 @@ def initialize_sample_data():
             },
             {
                 "policyName": "Family Coverage",
+                "planName": "Family",
                 "annualLimit": 25000,
                 "deductible": 200,
                 "coverage": 95,
@@ -741,6 +1399,10 @@ def initialize_sample_data():
         
         policies_collection.insert_many(sample_policies)
         
+        rebuild_plan_distribution()
+        backfill_member_references()
+        clear_billing_reports()
+        
         return jsonify({"message": "Sample data initialized successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
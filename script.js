@@ -164,7 +164,10 @@ class MedicalCoverageSystem {
         
         this.updateCharts({
             serviceUsage: [65, 78, 85, 92, 88, 95, 102, 88, 96, 78, 85, 92],
-            coverageDistribution: [1, 1, 1]
+            coverageDistribution: {
+                labels: ['Basic', 'Premium', 'Family'],
+                data: [1, 1, 1]
+            }
         });
     }
 
@@ -243,7 +246,12 @@ class MedicalCoverageSystem {
         }
         
         if (data && data.coverageDistribution) {
-            this.charts.coverageChart.data.datasets[0].data = data.coverageDistribution;
+            // One slot per plan returned by the API, cycling the palette if needed
+            const colors = ['#3498db', '#e74c3c', '#27ae60', '#f39c12', '#9b59b6', '#1abc9c', '#34495e'];
+            const distribution = data.coverageDistribution;
+            this.charts.coverageChart.data.labels = distribution.labels;
+            this.charts.coverageChart.data.datasets[0].data = distribution.data;
+            this.charts.coverageChart.data.datasets[0].backgroundColor = distribution.labels.map((_, i) => colors[i % colors.length]);
             this.charts.coverageChart.update();
         }
     }
@@ -994,6 +1002,10 @@ class MedicalCoverageSystem {
                     <label for="policy-name">Policy Name</label>
                     <input type="text" id="policy-name" required>
                 </div>
+                <div class="form-group">
+                    <label for="policy-plan">Plan Name</label>
+                    <input type="text" id="policy-plan" placeholder="Coverage plan employees are assigned, e.g. Basic" required>
+                </div>
                 <div class="form-group">
                     <label for="policy-limit">Annual Limit</label>
                     <input type="number" id="policy-limit" min="0" step="1000" required>
@@ -1027,6 +1039,7 @@ class MedicalCoverageSystem {
             
             const formData = {
                 policyName: document.getElementById('policy-name').value,
+                planName: document.getElementById('policy-plan').value,
                 annualLimit: parseInt(document.getElementById('policy-limit').value),
                 deductible: parseInt(document.getElementById('policy-deductible').value),
                 coverage: parseInt(document.getElementById('policy-coverage').value),